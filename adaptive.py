@@ -0,0 +1,123 @@
+import collections
+import itertools
+import json
+import os
+import threading
+
+import numpy as np
+
+import whisper
+
+MODEL_SIZES = ('base', 'small', 'medium')
+PROFILE_DURATIONS = (2, 5, 10, 20)
+# Fewer distinct recordings would mostly repeat the same words in every clip
+MIN_PROFILE_UTTERANCES = 3
+
+
+class AdaptivePolicy(object):
+    """
+    Picks a Whisper size per utterance from measured real-time factors.
+
+    Every transcription adds an ``(audio seconds, inference seconds)`` sample for
+    the size that ran it. Latency is modeled per size as ``fixed + rtf * duration``
+    with a least squares fit over the recent samples, and :func:`choose` returns the
+    largest size whose predicted latency fits the budget. Samples are kept in a JSON
+    file next to the config so the profile survives restarts.
+    """
+
+    def __init__(self, budget: float = 2.0, sizes=MODEL_SIZES, path: str = None, max_samples: int = 50):
+        self.budget = budget
+        self.sizes = tuple(sizes)
+        self.path = path or os.path.join(os.getcwd(), 'model_profile.json')
+        self._lock = threading.Lock()
+        self._samples = {size: collections.deque(maxlen=max_samples) for size in self.sizes}
+        self._load()
+
+    def is_profiled(self) -> bool:
+        return all(self._samples[size] for size in self.sizes)
+
+    def record(self, param_size: str, duration: float, elapsed: float, save: bool = True):
+        if param_size not in self._samples or duration <= 0:
+            return
+        with self._lock:
+            self._samples[param_size].append((duration, elapsed))
+        if save:
+            self.save()
+
+    def predict(self, param_size: str, duration: float):
+        """Predicted inference seconds for ``duration`` seconds of audio, ``None`` if the size was never measured"""
+        with self._lock:
+            samples = list(self._samples.get(param_size, ()))
+        if not samples:
+            return None
+        durations, elapsed = np.array(samples).T
+        if len(set(durations)) < 2:
+            return float(np.mean(elapsed / durations)) * duration
+        rtf, fixed = np.polyfit(durations, elapsed, 1)
+        if rtf < 0:
+            # Noisy samples can tilt the fit so longer clips look faster, the average is safer then
+            return float(np.mean(elapsed / durations)) * duration
+        return max(0.0, float(fixed + rtf * duration))
+
+    def real_time_factor(self, param_size: str, duration: float):
+        latency = self.predict(param_size, duration)
+        return None if latency is None else latency / duration
+
+    def choose(self, duration: float) -> str:
+        """The largest measured size predicted to finish within the budget, the smallest size otherwise"""
+        for size in reversed(self.sizes):
+            latency = self.predict(size, duration)
+            if latency is not None and latency <= self.budget:
+                return size
+        return self.sizes[0]
+
+    def profile(self, asr, utterances: list[np.ndarray], durations=PROFILE_DURATIONS, progress_func=None):
+        """
+        Measure every size on clips of each duration made of real speech.
+
+        ``asr`` is an :class:`asr_server.ASRClient` and ``utterances`` are 16 kHz
+        recordings, joined one after the other until a clip is long enough. The
+        decoder's cost depends on what it hears, so noise or one word repeated
+        would not give representative timings. The first run of each size is a
+        warmup that also loads the model, so it is not recorded.
+        """
+        utterances = [audio for audio in utterances if len(audio)]
+        if len(utterances) < MIN_PROFILE_UTTERANCES:
+            raise ValueError(f'Profiling needs at least {MIN_PROFILE_UTTERANCES} recordings')
+        for size in self.sizes:
+            if progress_func is not None:
+                progress_func(f'Profiling {size} model...')
+            asr.transcribe_timed(_clip(utterances, durations[0]), size)
+            for duration in durations:
+                _, elapsed = asr.transcribe_timed(_clip(utterances, duration), size)
+                self.record(size, duration, elapsed, save=False)
+        self.save()
+
+    def save(self):
+        with self._lock:
+            data = {size: list(samples) for size, samples in self._samples.items()}
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            return
+        for size, samples in data.items():
+            if size in self._samples:
+                self._samples[size].extend(tuple(sample) for sample in samples)
+
+
+def _clip(utterances: list[np.ndarray], duration: float) -> np.ndarray:
+    samples = int(duration * whisper.SAMPLE_RATE)
+    parts, total = [], 0
+    for audio in itertools.cycle(utterances):
+        if total >= samples:
+            break
+        parts.append(audio)
+        total += len(audio)
+    return np.concatenate(parts)[:samples].astype(np.float32)
@@ -0,0 +1,226 @@
+import collections
+import gc
+import io
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import whisper
+
+# Room for 30 seconds of 16 kHz float32 audio, the buffer grows if a longer clip comes in
+INITIAL_BUFFER_SAMPLES = whisper.SAMPLE_RATE * 30
+# Model sizes kept loaded at once, medium alone takes about 3 GB in float32
+MAX_LOADED_ENGINES = 2
+
+
+def serve(conn, engine_name: str, param_size: str):
+    """
+    Entry point of the ASR worker process.
+
+    Requests arrive on ``conn`` as ``(kind, request_id, args)`` tuples and every
+    reply is sent back as ``(kind, request_id, payload)``. Audio is not pickled,
+    the client writes it into a shared memory block and only sends its name and length.
+
+    Transcriptions may ask for a specific model size, which is loaded on first use.
+    At most ``MAX_LOADED_ENGINES`` sizes stay loaded, the least recently used one
+    is unloaded to make room, and ``load`` unloads every size but the new default.
+    """
+    try:
+        engines = collections.OrderedDict({param_size: whisper.create_engine(engine_name, param_size)})
+    except Exception as e:
+        conn.send(('error', None, f'{type(e).__name__}: {e}'))
+        return
+    conn.send(('ready', None, engines[param_size].is_cuda()))
+
+    shm = None
+    while True:
+        try:
+            kind, request_id, args = conn.recv()
+        except EOFError:
+            break
+        if kind == 'stop':
+            break
+        try:
+            if kind == 'transcribe':
+                name, length, size = args
+                size = size or param_size
+                if size not in engines:
+                    while len(engines) >= MAX_LOADED_ENGINES:
+                        engines.popitem(last=False)
+                    # Free the unloaded weights before the next size allocates its own
+                    gc.collect()
+                    engines[size] = whisper.create_engine(engine_name, size)
+                engines.move_to_end(size)
+                if shm is None or shm.name != name:
+                    if shm is not None:
+                        shm.close()
+                    shm = SharedMemory(name=name)
+                audio = np.ndarray((length,), dtype=np.float32, buffer=shm.buf)
+                start = time.perf_counter()
+                result = engines[size].transcribe_audio(audio).strip(), time.perf_counter() - start
+                del audio
+            elif kind == 'load':
+                param_size = args[0]
+                engine = engines.get(param_size)
+                engines.clear()
+                gc.collect()
+                engines[param_size] = engine or whisper.create_engine(engine_name, param_size)
+                del engine
+                result = param_size
+            else:
+                raise ValueError(f"Unknown request '{kind}'")
+            conn.send(('result', request_id, result))
+        except Exception as e:
+            conn.send(('error', request_id, f'{type(e).__name__}: {e}'))
+    if shm is not None:
+        shm.close()
+
+
+class ASRClient(object):
+    """
+    Talks to an ASR engine that runs in its own process.
+
+    It has the same ``transcribe``/``set_param_size``/``is_cuda`` methods as
+    :class:`whisper.ASREngine`, but torch never gets imported in the GUI process
+    and inference does not compete with the Qt event loop for the GIL. Calls block
+    the calling thread only. If the worker crashes, pending calls raise
+    ``RuntimeError`` and a new worker is started with the last loaded model size.
+
+    ``ready_func`` is called with the client once the model is loaded and
+    ``error_func`` with the error message if loading it fails, both from a
+    background thread.
+    """
+
+    def __init__(self, engine_name: str = 'transformers', param_size: str = 'base', ready_func=None,
+                 error_func=None):
+        self.engine_name = engine_name
+        self.param_size = param_size
+        self.ready_func = ready_func
+        self.error_func = error_func
+        self.ready = threading.Event()
+        self.last_error = None
+        self._ctx = multiprocessing.get_context('spawn')
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._transcribe_lock = threading.Lock()
+        self._pending = {}
+        self._cuda = False
+        self._shm = None
+        self._closing = False
+        self._start()
+
+    def is_cuda(self) -> bool:
+        """Whether the worker runs on CUDA, ``False`` until the worker has reported in"""
+        return self._cuda
+
+    def transcribe(self, file_name: str) -> str:
+        return self.transcribe_audio(whisper.load_audio(file_name))
+
+    def transcribe_bytes(self, data: bytes) -> str:
+        """Transcribe an encoded audio file held in memory"""
+        return self.transcribe_audio(whisper.load_audio(io.BytesIO(data)))
+
+    def transcribe_audio(self, audio: np.ndarray) -> str:
+        return self.transcribe_timed(audio)[0]
+
+    def transcribe_timed(self, audio: np.ndarray, param_size: str = None) -> tuple[str, float]:
+        """
+        Transcribe with the given model size, or the current one, and also return
+        how many seconds the worker spent on inference.
+        """
+        audio = np.asarray(audio, dtype=np.float32)
+        with self._transcribe_lock:
+            shm = self._ensure_buffer(len(audio))
+            np.ndarray((len(audio),), dtype=np.float32, buffer=shm.buf)[:] = audio
+            return self._request('transcribe', shm.name, len(audio), param_size).result()
+
+    def set_param_size(self, param_size: str = 'base'):
+        self._request('load', param_size).result()
+        self.param_size = param_size
+
+    def close(self):
+        self._closing = True
+        try:
+            self._conn.send(('stop', None, ()))
+        except (OSError, ValueError):
+            pass
+        self._process.join(timeout=2)
+        if self._process.is_alive():
+            self._process.terminate()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _start(self):
+        self.ready.clear()
+        parent_conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=serve, args=(child_conn, self.engine_name, self.param_size),
+                                          daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        threading.Thread(target=self._read_loop, args=(parent_conn,), daemon=True).start()
+
+    def _request(self, kind: str, *args) -> Future:
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            try:
+                self._conn.send((kind, request_id, args))
+            except (OSError, ValueError) as e:
+                self._pending.pop(request_id)
+                future.set_exception(RuntimeError(f'ASR worker is not running: {self.last_error or e}'))
+        return future
+
+    def _read_loop(self, conn):
+        while True:
+            try:
+                kind, request_id, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == 'ready':
+                self._cuda = payload
+                self.ready.set()
+                if self.ready_func is not None:
+                    self.ready_func(self)
+                continue
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if kind == 'error':
+                self.last_error = payload
+                if future is not None:
+                    future.set_exception(RuntimeError(payload))
+                elif request_id is None and self.error_func is not None:
+                    # The worker could not load its model and is about to exit
+                    self.error_func(payload)
+            elif future is not None:
+                future.set_result(payload)
+        conn.close()
+        self._on_worker_exit()
+
+    def _on_worker_exit(self):
+        was_ready = self.ready.is_set()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(self.last_error or 'ASR worker process exited'))
+        # Only restart a worker that managed to load its model, otherwise it would crash in a loop
+        if not self._closing and was_ready:
+            self._start()
+
+    def _ensure_buffer(self, samples: int) -> SharedMemory:
+        nbytes = samples * np.dtype(np.float32).itemsize
+        if self._shm is None or self._shm.size < nbytes:
+            if self._shm is not None:
+                self._shm.close()
+                self._shm.unlink()
+            size = max(nbytes, INITIAL_BUFFER_SAMPLES * np.dtype(np.float32).itemsize)
+            self._shm = SharedMemory(create=True, size=size)
+        return self._shm
@@ -0,0 +1,258 @@
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+import whisper
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+TRANSCRIPTS = 'transcripts.tsv'
+# Public domain Harvard sentence recordings from the Open Speech Repository, one list of ten sentences per file.
+# List 1 covers harvard_01 to harvard_10 and the first two sentences of list 2 are harvard_11 and harvard_12.
+OSR_URL = 'https://www.voiptroubleshooter.com/open_speech/american/'
+OSR_RECORDINGS = (('OSR_us_000_0010_8k.wav', 10), ('OSR_us_000_0011_8k.wav', 2))
+OSR_SENTENCES_PER_FILE = 10
+
+
+def read_transcripts(corpus_dir: str = CORPUS_DIR) -> list[tuple[str, str]]:
+    """Return ``(file name, reference transcript)`` pairs from the corpus index"""
+    with open(os.path.join(corpus_dir, TRANSCRIPTS), 'r', encoding='utf-8') as f:
+        return [tuple(line.rstrip('\n').split('\t', 1)) for line in f if line.strip()]
+
+
+def load_corpus(corpus_dir: str = CORPUS_DIR) -> list[tuple]:
+    """Return ``(audio, reference)`` pairs for every utterance that has an audio file"""
+    corpus = []
+    for file_name, reference in read_transcripts(corpus_dir):
+        path = os.path.join(corpus_dir, file_name)
+        if os.path.exists(path):
+            corpus.append((whisper.load_audio(path), reference))
+    return corpus
+
+
+def build_corpus(voice: str, corpus_dir: str = CORPUS_DIR, replace: bool = False):
+    """Synthesize the missing corpus utterances, or all of them, with ElevenLabs and store them as 16 kHz FLAC"""
+    from configuration import ConfigFile, ConfigNode
+    from elevenlabs_tts import ElevenLabsTTS
+
+    tts = ElevenLabsTTS(ConfigFile('config'))
+    voice = voice or ConfigFile('config').get(ConfigNode.VOICE)
+    for file_name, reference in read_transcripts(corpus_dir):
+        path = os.path.join(corpus_dir, file_name)
+        if os.path.exists(path) and not replace:
+            continue
+        audio, sample_rate = sf.read(io.BytesIO(tts.tts(reference, voice)), dtype='float32')
+        sf.write(path, whisper.to_model_input(audio, sample_rate), whisper.SAMPLE_RATE, format='FLAC')
+        print(f'Wrote {path}')
+
+
+def split_sentences(audio: np.ndarray, sample_rate: int, count: int, threshold_db: float = -35,
+                    min_duration: float = 0.4, padding: float = 0.15) -> list[np.ndarray]:
+    """
+    Cut a recording of ``count`` sentences at the ``count - 1`` longest pauses.
+
+    Frames more than ``threshold_db`` below the speech level, or close to the
+    background noise, are silent. Only pauses between phrases of at least
+    ``min_duration`` are cut at, so clicks and breaths do not count as speech.
+    """
+    frame = int(0.02 * sample_rate)
+    frames = len(audio) // frame
+    energy = np.sqrt(np.mean(audio[:frames * frame].reshape(frames, frame) ** 2, axis=1)) + 1e-10
+    # Percentiles rather than the extremes, so a single click does not set the speech level, and
+    # the threshold stays clear of the background noise of the recording
+    level = 20 * np.log10(energy)
+    voiced = level > max(np.percentile(level, 95) + threshold_db, np.percentile(level, 10) + 10)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    runs = []
+    for begin, end in zip(edges[::2], edges[1::2]):
+        # Stops and short gaps inside a phrase do not separate it
+        if runs and begin - runs[-1][1] < 0.15 * sample_rate / frame:
+            begin = runs.pop()[0]
+        runs.append((begin, end))
+    shortest = min_duration * sample_rate / frame
+    phrases = [(begin, end) for begin, end in runs if end - begin >= shortest]
+    if len(phrases) < count:
+        return [audio[begin * frame:end * frame] for begin, end in phrases]
+    pauses = sorted(range(len(phrases) - 1), key=lambda i: phrases[i + 1][0] - phrases[i][1], reverse=True)
+    cuts = sorted(pauses[:count - 1])
+    segments = [[phrases[first][0], phrases[last][1]]
+                for first, last in zip([0] + [i + 1 for i in cuts], cuts + [len(phrases) - 1])]
+    # Short sounds like "a" belong to the sentence they are close to, clicks and breaths stand apart
+    for begin, end in runs:
+        for segment in segments:
+            if end - begin < shortest and segment[0] - end < shortest and begin - segment[1] < shortest:
+                segment[0], segment[1] = min(segment[0], begin), max(segment[1], end)
+                break
+    pad = int(padding * sample_rate)
+    return [audio[max(0, begin * frame - pad):end * frame + pad] for begin, end in segments]
+
+
+def fetch_corpus(corpus_dir: str = CORPUS_DIR, replace: bool = False):
+    """Download the Open Speech Repository Harvard recordings and store each missing sentence as 16 kHz FLAC"""
+    names = [file_name for file_name, _ in read_transcripts(corpus_dir)]
+    for recording, used in OSR_RECORDINGS:
+        with urllib.request.urlopen(OSR_URL + recording, timeout=60) as response:
+            audio, sample_rate = sf.read(io.BytesIO(response.read()), dtype='float32')
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        sentences = split_sentences(audio, sample_rate, OSR_SENTENCES_PER_FILE)
+        durations = [len(sentence) / sample_rate for sentence in sentences]
+        # A sentence that is missing, too short or too long means the files would not match their transcripts
+        if len(sentences) != OSR_SENTENCES_PER_FILE or not all(1 <= d <= 6 for d in durations):
+            raise RuntimeError(f'Could not split {recording} into {OSR_SENTENCES_PER_FILE} sentences, got '
+                               f"{', '.join(f'{d:.1f}s' for d in durations)}")
+        for sentence, file_name in zip(sentences[:used], names):
+            path = os.path.join(corpus_dir, file_name)
+            if replace or not os.path.exists(path):
+                sf.write(path, whisper.to_model_input(sentence, sample_rate), whisper.SAMPLE_RATE, format='FLAC')
+                print(f'Wrote {path}')
+        names = names[used:]
+
+
+def word_error_rate(reference: str, hypothesis: str) -> tuple[int, int]:
+    """Return the word edit distance and the number of reference words, after normalization"""
+    ref = whisper.normalize_text(reference).split()
+    hyp = whisper.normalize_text(hypothesis).split()
+    distances = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, distances[j] = distances[j], min(distances[j] + 1, distances[j - 1] + 1,
+                                                       previous + (ref_word != hyp_word))
+    return distances[-1], len(ref)
+
+
+def configurations(engines, sizes, beams, devices=None) -> list[dict]:
+    """Every engine, size, device, precision and beam size combination this machine can run"""
+    configs = []
+    for engine_name in engines:
+        engine = whisper.ENGINES[engine_name]
+        try:
+            available = ['cpu', 'cuda'] if engine.cuda_available() else ['cpu']
+        except ImportError as e:
+            print(f'Skipping {engine_name}: {e}', file=sys.stderr)
+            continue
+        for device in devices or available:
+            if device not in available:
+                continue
+            for precision, size, beam in itertools.product(engine.precisions[device], sizes, beams):
+                configs.append({'engine': engine_name, 'size': size, 'device': device,
+                                'precision': precision, 'beam_size': beam})
+    return configs
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process, ``None`` where ``resource`` is not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_configuration(config: dict, corpus_dir: str = CORPUS_DIR) -> dict:
+    """Benchmark one configuration, this runs in a fresh process so load time and peak memory are its own"""
+    corpus = load_corpus(corpus_dir)
+    start = time.perf_counter()
+    engine = whisper.create_engine(config['engine'], config['size'], device=config['device'],
+                                   precision=config['precision'], beam_size=config['beam_size'])
+    load_time = time.perf_counter() - start
+
+    # Warm up kernels and caches on the first utterance before timing
+    engine.transcribe_audio(corpus[0][0])
+    errors = words = 0
+    audio_seconds = elapsed = 0.0
+    hypotheses = []
+    for audio, reference in corpus:
+        start = time.perf_counter()
+        hypothesis = engine.transcribe_audio(audio).strip()
+        elapsed += time.perf_counter() - start
+        audio_seconds += len(audio) / whisper.SAMPLE_RATE
+        distance, count = word_error_rate(reference, hypothesis)
+        errors += distance
+        words += count
+        hypotheses.append(hypothesis)
+
+    result = dict(config, wer=errors / max(words, 1), rtf=elapsed / audio_seconds, load_time=load_time,
+                  peak_memory_mb=peak_memory_mb(), utterances=len(corpus), hypotheses=hypotheses)
+    if config['device'] == 'cuda' and config['engine'] == 'transformers':
+        import torch
+        result['peak_cuda_memory_mb'] = torch.cuda.max_memory_allocated() / 1024 ** 2
+    return result
+
+
+def run_matrix(configs: list[dict], corpus_dir: str = CORPUS_DIR) -> list[dict]:
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for config in configs:
+        print(f"Running {config['engine']} {config['size']} {config['device']} {config['precision']} "
+              f"beam={config['beam_size']}...", file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                results.append(executor.submit(run_configuration, config, corpus_dir).result())
+            except Exception as e:
+                results.append(dict(config, error=f'{type(e).__name__}: {e}'))
+    return results
+
+
+def format_table(results: list[dict]) -> str:
+    header = ('engine', 'size', 'device', 'precision', 'beam', 'WER', 'RTF', 'load s', 'peak MB')
+    rows = [header]
+    for r in results:
+        config = (r['engine'], r['size'], r['device'], r['precision'], str(r['beam_size']))
+        if 'error' in r:
+            rows.append(config + (r['error'], '', '', ''))
+            continue
+        peak = r.get('peak_cuda_memory_mb', r['peak_memory_mb'])
+        rows.append(config + (f"{r['wer']:.1%}", f"{r['rtf']:.3f}", f"{r['load_time']:.1f}",
+                              '-' if peak is None else f'{peak:.0f}'))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='WER, real-time factor, load time and peak memory '
+                                                 'of every ASR configuration on the bundled corpus')
+    parser.add_argument('--engines', nargs='+', default=list(whisper.ENGINES), choices=list(whisper.ENGINES))
+    parser.add_argument('--sizes', nargs='+', default=['tiny', 'base', 'small', 'medium'])
+    parser.add_argument('--devices', nargs='+', choices=['cpu', 'cuda'])
+    parser.add_argument('--beams', nargs='+', type=int, default=[1, 5])
+    parser.add_argument('--corpus', default=CORPUS_DIR)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--build-corpus', action='store_true',
+                        help='synthesize missing corpus audio with ElevenLabs and exit')
+    parser.add_argument('--voice', help='ElevenLabs voice for --build-corpus, defaults to the configured one')
+    parser.add_argument('--fetch-corpus', action='store_true',
+                        help='download public domain recordings of the corpus sentences and exit')
+    parser.add_argument('--replace', action='store_true',
+                        help='make --fetch-corpus and --build-corpus overwrite the existing corpus audio')
+    args = parser.parse_args()
+
+    if args.fetch_corpus:
+        fetch_corpus(args.corpus, args.replace)
+        sys.exit(0)
+    if args.build_corpus:
+        build_corpus(args.voice, args.corpus, args.replace)
+        sys.exit(0)
+    if not load_corpus(args.corpus):
+        sys.exit(f'No corpus audio in {args.corpus}, run with --fetch-corpus or --build-corpus first')
+
+    matrix = run_matrix(configurations(args.engines, args.sizes, args.beams, args.devices), args.corpus)
+    print(format_table(matrix))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(matrix, f, indent=2)
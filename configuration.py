@@ -70,6 +70,12 @@ class ConfigNode(Enum):
     INPUT = ("Input", "")
     OUTPUT = ("Output", "")
     T_MODE = ("T_Mode", "0")
+    ASR_ENGINE = ("ASR_Engine", "transformers")
+    SERVER = ("Server", "")
+    SERVER_TOKEN = ("Server_Token", "")
+    ADAPTIVE = ("Adaptive", "0")
+    LATENCY_BUDGET = ("Latency_Budget", "2.0")
+    HISTORY_QUOTA_MB = ("History_Quota_MB", "200")
 
     def get_key(self):
         return self.value[0]
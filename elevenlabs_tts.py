@@ -2,7 +2,6 @@ import os
 import platform
 
 from elevenlabslib import *
-from elevenlabslib.helpers import save_bytes_to_path
 
 from configuration import ConfigFile, ConfigNode
 
@@ -15,8 +14,7 @@ class ElevenLabsTTS:
         """Return a list of voices"""
         return [voice.initialName for voice in self.user.get_available_voices()]
 
-    def tts(self, text: str, voice: str) -> None:
-        """Return the audio from the text"""
+    def tts(self, text: str, voice: str) -> bytes:
+        """Return the encoded audio of the text, it is kept in memory instead of being written to disk"""
         voice = self.user.get_voices_by_name(voice)[0]
-        data = voice.generate_audio_bytes(text, 0.7, 0.7)
-        save_bytes_to_path("elevenlabs.wav", data)
+        return voice.generate_audio_bytes(text, 0.7, 0.7)
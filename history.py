@@ -0,0 +1,123 @@
+import collections
+import io
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import soundfile as sf
+
+Take = collections.namedtuple('Take', ['id', 'created', 'transcript', 'voice'])
+
+
+class SessionHistory(object):
+    """
+    Append-only store of every take.
+
+    The recording is kept as FLAC and the synthesized audio as the compressed bytes
+    ElevenLabs returned, one file each per take. A small SQLite index holds the
+    transcripts so past outputs can be searched and replayed without running
+    Whisper or ElevenLabs again. When the files exceed ``quota_mb`` the oldest
+    takes are evicted first.
+    """
+
+    def __init__(self, directory: str = 'history', quota_mb: float = 200):
+        self.directory = os.path.join(os.getcwd(), directory)
+        self.quota = int(quota_mb * 1024 * 1024)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.directory, 'index.sqlite3'), check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS takes (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'created REAL, transcript TEXT, voice TEXT, input_file TEXT NOT NULL, '
+                         'output_file TEXT NOT NULL, size INTEGER DEFAULT 0)')
+        self._db.commit()
+
+    def add(self, recording: bytes, transcript: str, voice: str, output: bytes) -> int:
+        """
+        Store a take and return its id.
+
+        :param recording: The recorded WAV file contents.
+        :param output: The encoded audio returned by ElevenLabs.
+        """
+        audio, sample_rate = sf.read(io.BytesIO(recording), dtype='int16')
+        created = time.time()
+        # The files are written before the row exists, so a failed write never leaves a take without audio
+        prefix = f'{int(created * 1000)}_{secrets.token_hex(4)}'
+        input_file, output_file = f'{prefix}_input.flac', f'{prefix}_output.mp3'
+        try:
+            sf.write(os.path.join(self.directory, input_file), audio, sample_rate, format='FLAC')
+            with open(os.path.join(self.directory, output_file), 'wb') as f:
+                f.write(output)
+            size = sum(os.path.getsize(os.path.join(self.directory, name)) for name in (input_file, output_file))
+            with self._lock:
+                try:
+                    take_id = self._db.execute('INSERT INTO takes (created, transcript, voice, input_file, '
+                                               'output_file, size) VALUES (?, ?, ?, ?, ?, ?)',
+                                               (created, transcript, voice, input_file, output_file,
+                                                size)).lastrowid
+                    self._db.commit()
+                except Exception:
+                    self._db.rollback()
+                    raise
+        except Exception:
+            self._remove_files(input_file, output_file)
+            raise
+        with self._lock:
+            self._evict()
+        return take_id
+
+    def search(self, text: str = '', limit: int = 100) -> list[Take]:
+        """Most recent takes whose transcript contains ``text``, case-insensitively"""
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with self._lock:
+            rows = self._db.execute("SELECT id, created, transcript, voice FROM takes "
+                                    "WHERE transcript LIKE ? ESCAPE '\\' ORDER BY id DESC LIMIT ?",
+                                    (pattern, limit)).fetchall()
+        return [Take(*row) for row in rows]
+
+    def output(self, take_id: int) -> bytes:
+        """The synthesized audio of a take, ready for :func:`playback.decode_audio`"""
+        with self._lock:
+            row = self._db.execute('SELECT output_file FROM takes WHERE id = ?', (take_id,)).fetchone()
+        if row is None:
+            raise KeyError(take_id)
+        with open(os.path.join(self.directory, row[0]), 'rb') as f:
+            return f.read()
+
+    def input_path(self, take_id: int) -> str:
+        with self._lock:
+            row = self._db.execute('SELECT input_file FROM takes WHERE id = ?', (take_id,)).fetchone()
+        if row is None:
+            raise KeyError(take_id)
+        return os.path.join(self.directory, row[0])
+
+    def usage(self) -> int:
+        """Bytes used by the stored takes"""
+        with self._lock:
+            return self._usage()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _usage(self) -> int:
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM takes').fetchone()[0]
+
+    def _evict(self):
+        usage = self._usage()
+        if usage <= self.quota:
+            return
+        for take_id, input_file, output_file, size in self._db.execute(
+                'SELECT id, input_file, output_file, size FROM takes ORDER BY id').fetchall():
+            if usage <= self.quota:
+                break
+            self._remove_files(input_file, output_file)
+            self._db.execute('DELETE FROM takes WHERE id = ?', (take_id,))
+            usage -= size
+        self._db.commit()
+
+    def _remove_files(self, *names):
+        for name in names:
+            if name and os.path.exists(os.path.join(self.directory, name)):
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,213 @@
+import collections
+import io
+
+import numpy as np
+import soundfile as sf
+from PySide6 import QtCore
+from PySide6.QtCore import QObject, QTimer
+from PySide6.QtMultimedia import QAudioSink, QAudioFormat, QAudioDevice, QMediaDevices
+
+
+def decode_audio(data: bytes) -> tuple[np.ndarray, int]:
+    """Decode an encoded clip (mp3, wav, flac, ...) in memory into float32 frames of shape (n, channels)"""
+    audio, sample_rate = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    return audio, sample_rate
+
+
+def prepare_clip(data: bytes, audio_format: QAudioFormat) -> tuple:
+    """
+    Decode a clip and convert it for a sink, the slow part of playback, meant to run off the GUI thread.
+
+    :return: ``(audio, sample_rate, pcm, audio_format)``, the arguments of :func:`PlaybackEngine.enqueue`.
+    """
+    audio, sample_rate = decode_audio(data)
+    return audio, sample_rate, convert_audio(audio, sample_rate, audio_format), audio_format
+
+
+def convert_audio(audio: np.ndarray, sample_rate: int, audio_format: QAudioFormat) -> bytes:
+    """Resample, remap channels and convert a float32 clip to the raw PCM layout of ``audio_format``"""
+    if audio.ndim == 1:
+        audio = audio[:, np.newaxis]
+    if sample_rate != audio_format.sampleRate():
+        import librosa
+        audio = librosa.resample(audio.T, orig_sr=sample_rate, target_sr=audio_format.sampleRate()).T
+
+    channels = audio_format.channelCount()
+    if audio.shape[1] != channels:
+        audio = np.repeat(audio.mean(axis=1, keepdims=True), channels, axis=1)
+
+    audio = np.clip(audio, -1.0, 1.0)
+    sample_format = audio_format.sampleFormat()
+    if sample_format == QAudioFormat.SampleFormat.Int16:
+        pcm = (audio * 0x7FFF).astype('<i2')
+    elif sample_format == QAudioFormat.SampleFormat.Int32:
+        pcm = (audio * 0x7FFFFFFF).astype('<i4')
+    elif sample_format == QAudioFormat.SampleFormat.UInt8:
+        pcm = ((audio + 1.0) * 127.5).astype(np.uint8)
+    else:
+        pcm = audio.astype('<f4')
+    return pcm.tobytes()
+
+
+Clip = collections.namedtuple('Clip', ['audio', 'sample_rate', 'pcm'])
+
+
+def convert_clips(clips: list[Clip], audio_format: QAudioFormat) -> tuple:
+    """
+    Convert queued clips to another format, meant to run off the GUI thread after a device switch.
+
+    :return: ``(clips, audio_format)``, the arguments of :func:`PlaybackEngine.requeue`.
+    """
+    return [clip._replace(pcm=convert_audio(clip.audio, clip.sample_rate, audio_format)) for clip in clips], \
+        audio_format
+
+
+class PlaybackEngine(QObject):
+    """
+    Low-latency playback of in-memory clips through a :class:`QAudioSink`.
+
+    Clips are written back to back into the same sink, so consecutive clips play
+    without a gap. Callers should convert clips to :attr:`format` with
+    :func:`convert_audio` off the GUI thread, the decoded audio is kept as well so
+    the queue can be converted again when the output device changes, see
+    :func:`set_device`.
+    :func:`interrupt` skips the clip that is being heard and :func:`flush` drops
+    everything that is queued.
+    """
+    queue_empty = QtCore.Signal()
+
+    def __init__(self, device: QAudioDevice = None, buffer_ms: int = 100, parent=None):
+        super(PlaybackEngine, self).__init__(parent)
+        self.buffer_ms = buffer_ms
+        # Clips that have not been heard completely, the first one is the audible one
+        self._clips = collections.deque()
+        # Index of the clip being written to the sink and how far into it
+        self._write_index = 0
+        self._offset = 0
+        # Bytes written since the sink started and where the first clip starts in that stream
+        self._written = 0
+        self._head_start = 0
+        # Clips taken out of the queue by a device switch, waiting to come back through requeue
+        self._stale = []
+        self._sink = None
+        self._io = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(10)
+        self._timer.timeout.connect(self._feed)
+        self.set_device(device or QMediaDevices.defaultAudioOutput())
+
+    def set_device(self, device: QAudioDevice) -> list[Clip]:
+        """
+        Switch the output device.
+
+        The queued clips are taken out and returned. Convert them to the new
+        :attr:`format` with :func:`convert_clips` off the GUI thread and hand them to
+        :func:`requeue`, playback waits for them and the current clip restarts.
+        """
+        self._stop_sink()
+        if self._sink is not None:
+            self._sink.deleteLater()
+        self.device = device
+        self.format = self._pick_format(device)
+        self._sink = QAudioSink(device, self.format, self)
+        self._sink.setBufferSize(self.format.bytesForDuration(self.buffer_ms * 1000))
+        self._stale.extend(self._clips)
+        self._clips.clear()
+        return list(self._stale)
+
+    def requeue(self, clips: list[Clip], audio_format: QAudioFormat):
+        """Put clips returned by :func:`set_device` back in front of the queue once converted"""
+        if audio_format != self.format:
+            # The device changed again, the newer switch brings these clips back itself
+            return
+        # Skip clips that were interrupted or flushed while being converted
+        waiting = {id(clip.audio) for clip in self._stale}
+        self._stale = []
+        self._clips.extendleft(reversed([clip for clip in clips if id(clip.audio) in waiting]))
+        if self._clips and self._io is None:
+            self._start_sink()
+
+    def enqueue(self, audio: np.ndarray, sample_rate: int, pcm: bytes = None, audio_format: QAudioFormat = None):
+        """
+        Queue a decoded clip.
+
+        :param pcm: The clip already converted to ``audio_format``, it is converted
+        here, on the calling thread, when missing or when the device format changed since.
+        """
+        if pcm is None or audio_format != self.format:
+            pcm = convert_audio(audio, sample_rate, self.format)
+        if not pcm:
+            return
+        self._clips.append(Clip(audio, sample_rate, pcm))
+        if self._io is None and not self._stale:
+            self._start_sink()
+
+    def interrupt(self):
+        """Stop the clip that is being heard and continue with the next one in the queue"""
+        if self._stale:
+            self._stale.pop(0)
+            return
+        if self._io is not None:
+            self._drop_heard()
+        if self._clips:
+            self._clips.popleft()
+        self._stop_sink()
+        if self._clips:
+            self._start_sink()
+
+    def flush(self):
+        """Stop playback and drop every queued clip"""
+        self._clips.clear()
+        self._stale = []
+        self._stop_sink()
+
+    def is_playing(self) -> bool:
+        return self._io is not None
+
+    def _feed(self):
+        while self._write_index < len(self._clips) and self._sink.bytesFree() > 0:
+            pcm = self._clips[self._write_index].pcm
+            written = self._io.write(pcm[self._offset:self._offset + self._sink.bytesFree()])
+            if written <= 0:
+                break
+            self._offset += written
+            self._written += written
+            if self._offset >= len(pcm):
+                self._write_index += 1
+                self._offset = 0
+        self._drop_heard()
+        if not self._clips and self._sink.bytesFree() == self._sink.bufferSize():
+            self._stop_sink()
+            self.queue_empty.emit()
+
+    def _drop_heard(self):
+        """Dequeue the clips the sink has already played out of its buffer"""
+        played = self._written - (self._sink.bufferSize() - self._sink.bytesFree())
+        while self._write_index > 0 and self._head_start + len(self._clips[0].pcm) <= played:
+            self._head_start += len(self._clips.popleft().pcm)
+            self._write_index -= 1
+
+    def _start_sink(self):
+        self._write_index = 0
+        self._offset = 0
+        self._written = 0
+        self._head_start = 0
+        self._io = self._sink.start()
+        self._timer.start()
+        self._feed()
+
+    def _stop_sink(self):
+        self._timer.stop()
+        if self._sink is not None:
+            self._sink.reset()
+            self._sink.stop()
+        self._io = None
+        self._write_index = 0
+        self._offset = 0
+
+    @staticmethod
+    def _pick_format(device: QAudioDevice) -> QAudioFormat:
+        audio_format = device.preferredFormat()
+        if audio_format.sampleFormat() == QAudioFormat.SampleFormat.Unknown:
+            audio_format.setSampleFormat(QAudioFormat.SampleFormat.Int16)
+        return audio_format
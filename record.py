@@ -1,50 +1,165 @@
-import pyaudio
+import collections
+import math
+import threading
 import wave
 
+import numpy as np
+import pyaudio
+
 
 # Attribution: https://github.com/dv66/audio-recorder-pyqt/blob/master/record.py
 # Repo: https://github.com/dv66/audio-recorder-pyqt
 
 
-def get_audio_devices():
-    p = pyaudio.PyAudio()
-    info = p.get_host_api_info_by_index(0)
-    numdevices = info.get('deviceCount')
+def get_audio_devices(pa: pyaudio.PyAudio = None) -> list[tuple[int, str]]:
+    """Return ``(device_index, name)`` for every input device of the default host API"""
+    owned = pa is None
+    if owned:
+        pa = pyaudio.PyAudio()
+    info = pa.get_host_api_info_by_index(0)
     devices = []
-    for i in range(0, numdevices):
-        if (p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
-            devices.append(p.get_device_info_by_host_api_device_index(0, i).get("name"))
+    for i in range(0, info.get('deviceCount')):
+        device = pa.get_device_info_by_host_api_device_index(0, i)
+        if device.get('maxInputChannels') > 0:
+            devices.append((device.get('index'), device.get('name')))
+    if owned:
+        pa.terminate()
     return devices
 
 
-class Recorder(object):
-    """A recorder class for recording audio to a WAV file.
+class AudioEngine(object):
+    """
+    A long-lived capture engine.
+
+    PortAudio and the selected input stream stay open for the lifetime of the
+    application, so pressing record does not pay for stream setup. The last
+    ``preroll`` seconds of audio are kept in a ring buffer and written to the
+    start of every recording, which keeps the first syllable from being clipped.
     Records in mono by default.
+
+    Calls that touch PortAudio hold an engine lock, so a device refresh on one
+    thread cannot terminate PortAudio under a stream being opened on another.
     """
 
-    def __init__(self, channels=1, rate=44100, frames_per_buffer=1024, update_func=None):
+    def __init__(self, channels=1, rate=16000, frames_per_buffer=1024, preroll=0.3, update_func=None):
         self.channels = channels
         self.rate = rate
         self.frames_per_buffer = frames_per_buffer
         self.update_func = update_func
+        self._preroll = collections.deque(maxlen=max(1, math.ceil(rate * preroll / frames_per_buffer)))
+        self._lock = threading.Lock()
+        # Separate from _lock, which the stream callback takes, as stopping a stream waits for its callback
+        self._pa_lock = threading.RLock()
+        self._pa = pyaudio.PyAudio()
+        self._stream = None
+        self._device_index = None
+        self._recording = None
+        self._devices = get_audio_devices(self._pa)
+
+    def get_audio_devices(self) -> list[str]:
+        """Return the cached input device names"""
+        return [name for _, name in self._devices]
+
+    def refresh_devices(self) -> list[str]:
+        """
+        Re-enumerate input devices after a hot-plug event.
+
+        PortAudio only scans devices on initialization, so it has to be restarted.
+        The current input is reopened afterwards if it is still connected.
+        """
+        with self._pa_lock:
+            if self.is_recording():
+                return self.get_audio_devices()
+            selected = self._device_name(self._device_index)
+            self._close_stream()
+            self._pa.terminate()
+            self._pa = pyaudio.PyAudio()
+            self._devices = get_audio_devices(self._pa)
+            names = self.get_audio_devices()
+            if selected in names:
+                self.select_input(names.index(selected))
+            return names
+
+    def select_input(self, position: int):
+        """Open the stream for the device at ``position`` in the cached device list"""
+        with self._pa_lock:
+            if position < 0 or position >= len(self._devices):
+                return
+            device_index = self._devices[position][0]
+            if self._stream is not None and device_index == self._device_index:
+                return
+            self._close_stream()
+            self._stream = self._pa.open(format=pyaudio.paInt16,
+                                         channels=self.channels,
+                                         rate=self.rate,
+                                         input=True,
+                                         frames_per_buffer=self.frames_per_buffer,
+                                         stream_callback=self._callback,
+                                         input_device_index=device_index)
+            self._device_index = device_index
+            self._stream.start_stream()
+
+    def start_recording(self, fname, mode='wb'):
+        """Start writing the stream to ``fname``, beginning with the buffered pre-roll"""
+        with self._pa_lock:
+            sample_width = self._pa.get_sample_size(pyaudio.paInt16)
+        recording = RecordingFile(fname, mode, self.channels, self.rate, sample_width)
+        with self._lock:
+            for chunk in self._preroll:
+                recording.write(chunk)
+            self._preroll.clear()
+            self._recording = recording
+        return recording
+
+    def stop_recording(self):
+        with self._lock:
+            recording, self._recording = self._recording, None
+        if recording is not None:
+            recording.close()
+        return recording
 
-    def open(self, fname, mode='wb'):
-        return RecordingFile(fname, mode, self.channels, self.rate,
-                             self.frames_per_buffer, self.update_func)
+    def is_recording(self) -> bool:
+        return self._recording is not None
+
+    def close(self):
+        self.stop_recording()
+        with self._pa_lock:
+            self._close_stream()
+            self._pa.terminate()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        with self._lock:
+            recording = self._recording
+            if recording is None:
+                self._preroll.append(in_data)
+            else:
+                recording.write(in_data)
+        if recording is not None and self.update_func is not None:
+            self.update_func(np.frombuffer(in_data, dtype=np.int16))
+        return in_data, pyaudio.paContinue
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+            self._device_index = None
+        self._preroll.clear()
+
+    def _device_name(self, device_index):
+        for index, name in self._devices:
+            if index == device_index:
+                return name
+        return None
 
 
 class RecordingFile(object):
-    def __init__(self, fname, mode, channels,
-                 rate, frames_per_buffer, update_func=None):
+    def __init__(self, fname, mode, channels, rate, sample_width):
         self.fname = fname
         self.mode = mode
         self.channels = channels
         self.rate = rate
-        self.frames_per_buffer = frames_per_buffer
-        self._pa = pyaudio.PyAudio()
-        self.wavefile = self._prepare_file(self.fname, self.mode)
-        self.update_func = update_func
-        self._stream = None
+        self.wavefile = self._prepare_file(self.fname, self.mode, sample_width)
 
     def __enter__(self):
         return self
@@ -52,53 +167,15 @@ class RecordingFile(object):
     def __exit__(self, exception, value, traceback):
         self.close()
 
-    def record(self, duration):
-        # Use a stream with no callback function in blocking mode
-        self._stream = self._pa.open(format=pyaudio.paInt16,
-                                     channels=self.channels,
-                                     rate=self.rate,
-                                     input=True,
-                                     frames_per_buffer=self.frames_per_buffer)
-        for _ in range(int(self.rate / self.frames_per_buffer * duration)):
-            audio = self._stream.read(self.frames_per_buffer)
-            self.wavefile.writeframes(audio)
-        return None
-
-    def start_recording(self, device_index: int):
-        # Use a stream with a callback in non-blocking mode
-        self._stream = self._pa.open(format=pyaudio.paInt16,
-                                     channels=self.channels,
-                                     rate=self.rate,
-                                     input=True,
-                                     frames_per_buffer=self.frames_per_buffer,
-                                     stream_callback=self.get_callback(),
-                                     input_device_index=device_index)
-        self._stream.start_stream()
-        return self
-
-    def stop_recording(self):
-        self._stream.stop_stream()
-        return self
-
-    def get_callback(self):
-        def callback(in_data, frame_count, time_info, status):
-            self.wavefile.writeframes(in_data)
-            data = [int.from_bytes(in_data[i:i + 2], byteorder='little', signed=True) for i in
-                    range(0, len(in_data), 2)]
-            if self.update_func is not None:
-                self.update_func(data)
-            return in_data, pyaudio.paContinue
-
-        return callback
+    def write(self, frames: bytes):
+        self.wavefile.writeframes(frames)
 
     def close(self):
-        self._stream.close()
-        self._pa.terminate()
         self.wavefile.close()
 
-    def _prepare_file(self, fname, mode='wb'):
+    def _prepare_file(self, fname, mode, sample_width):
         wavefile = wave.open(fname, mode)
         wavefile.setnchannels(self.channels)
-        wavefile.setsampwidth(self._pa.get_sample_size(pyaudio.paInt16))
+        wavefile.setsampwidth(sample_width)
         wavefile.setframerate(self.rate)
         return wavefile
@@ -0,0 +1,288 @@
+import collections
+import hmac
+import io
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import whisper
+
+DEFAULT_PORT = 8765
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+# Largest request bodies accepted, a recording for /transcribe and small JSON documents otherwise
+MAX_AUDIO_BYTES = 50 * 1024 * 1024
+MAX_JSON_BYTES = 64 * 1024
+
+
+class BatchScheduler(object):
+    """
+    Groups concurrent transcription requests into micro-batches.
+
+    A batch is dispatched as soon as ``max_batch_size`` requests are waiting or
+    the oldest waiting request has been queued for ``max_wait`` seconds. Every
+    client has its own queue and batches are filled round-robin across clients,
+    so one operator sending many clips cannot starve the others.
+    """
+
+    def __init__(self, engine: whisper.ASREngine, max_batch_size: int = 8, max_wait: float = 0.05):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.engine_lock = threading.Lock()
+        self._queues = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, client_id: str, audio: np.ndarray) -> Future:
+        future = Future()
+        with self._cond:
+            self._queues.setdefault(client_id, collections.deque()).append((time.monotonic(), audio, future))
+            self._cond.notify()
+        return future
+
+    def set_param_size(self, param_size: str):
+        with self.engine_lock:
+            self.engine.set_param_size(param_size)
+
+    def _pending(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+            deadline = min(queue[0][0] for queue in self._queues.values()) + self.max_wait
+            while self._pending() < self.max_batch_size and (remaining := deadline - time.monotonic()) > 0:
+                self._cond.wait(remaining)
+
+            batch = []
+            while len(batch) < self.max_batch_size and self._queues:
+                for client_id in list(self._queues):
+                    queue = self._queues[client_id]
+                    batch.append(queue.popleft())
+                    # Served clients go to the back so the next batch starts with someone else
+                    if queue:
+                        self._queues.move_to_end(client_id)
+                    else:
+                        del self._queues[client_id]
+                    if len(batch) == self.max_batch_size:
+                        break
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with self.engine_lock:
+                    texts = self.engine.transcribe_batch([audio for _, audio, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), text in zip(batch, texts):
+                future.set_result(text.strip())
+
+
+class S4TSRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the S4TS service.
+
+    ``POST /transcribe`` takes an encoded audio file as the body, ``POST /tts``
+    takes ``{"text", "voice"}`` and returns the synthesized audio, ``GET /voices``
+    lists the ElevenLabs voices, ``GET /status`` describes the loaded model and
+    ``POST /model`` takes ``{"param_size"}``. Clients identify themselves with
+    the ``X-Client-Id`` header, which is what fair queuing is keyed on. When the
+    server has a token, every request must carry it in the ``X-S4TS-Token`` header,
+    which is checked before the body is read.
+    """
+
+    def do_GET(self):
+        if not self._authorized():
+            self._send_json({'error': 'Missing or wrong X-S4TS-Token'}, 401)
+        elif self.path == '/status':
+            self._send_json({'param_size': self.server.scheduler.engine.param_size,
+                             'cuda': self.server.scheduler.engine.is_cuda()})
+        elif self.path == '/voices':
+            self._send_json(self.server.tts.get_voices())
+        else:
+            self._send_json({'error': f'Unknown path {self.path}'}, 404)
+
+    def do_POST(self):
+        # The body is left unread on every early reply, so the connection cannot be reused
+        if not self._authorized():
+            self.close_connection = True
+            self._send_json({'error': 'Missing or wrong X-S4TS-Token'}, 401)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        limit = MAX_AUDIO_BYTES if self.path == '/transcribe' else MAX_JSON_BYTES
+        if length < 0 or length > limit:
+            self.close_connection = True
+            self._send_json({'error': f'Body must be between 0 and {limit} bytes'}, 413)
+            return
+        body = self.rfile.read(length)
+        try:
+            if self.path == '/transcribe':
+                audio = whisper.load_audio(io.BytesIO(body))
+                client_id = self.headers.get('X-Client-Id', self.client_address[0])
+                self._send_json({'text': self.server.scheduler.submit(client_id, audio).result()})
+            elif self.path == '/tts':
+                request = json.loads(body)
+                self._send(self.server.tts.tts(request['text'], request['voice']), 'audio/mpeg')
+            elif self.path == '/model':
+                param_size = json.loads(body)['param_size']
+                self.server.scheduler.set_param_size(param_size)
+                self._send_json({'param_size': param_size})
+            else:
+                self._send_json({'error': f'Unknown path {self.path}'}, 404)
+        except (KeyError, ValueError) as e:
+            self._send_json({'error': f'Bad request: {e}'}, 400)
+        except Exception as e:
+            self._send_json({'error': f'{type(e).__name__}: {e}'}, 500)
+
+    def _authorized(self) -> bool:
+        if not self.server.token:
+            return True
+        return hmac.compare_digest(self.headers.get('X-S4TS-Token', '').encode('utf-8'),
+                                   self.server.token.encode('utf-8'))
+
+    def _send_json(self, payload, status: int = 200):
+        self._send(json.dumps(payload).encode('utf-8'), 'application/json', status)
+
+    def _send(self, data: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class S4TSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, scheduler: BatchScheduler, tts, token: str = ''):
+        super().__init__(address, S4TSRequestHandler)
+        self.scheduler = scheduler
+        self.tts = tts
+        self.token = token
+
+
+class ServiceClient(object):
+    """
+    Thin client for a remote S4TS service.
+
+    It stands in for both the ASR engine and :class:`elevenlabs_tts.ElevenLabsTTS`
+    in the desktop UI. Failed requests raise ``RuntimeError``. ``ready_func`` and
+    ``error_func`` are called like for :class:`asr_server.ASRClient`, once the
+    service has answered or could not be reached.
+    """
+
+    def __init__(self, url: str, token: str = '', client_id: str = None, ready_func=None, error_func=None,
+                 timeout: float = 120):
+        self.url = url.rstrip('/')
+        if '://' not in self.url:
+            self.url = f'http://{self.url}'
+        self.token = token
+        self.client_id = client_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.timeout = timeout
+        self.ready_func = ready_func
+        self.error_func = error_func
+        self.param_size = None
+        self._cuda = False
+        threading.Thread(target=self._fetch_status, daemon=True).start()
+
+    def is_cuda(self) -> bool:
+        return self._cuda
+
+    def transcribe(self, file_name: str) -> str:
+        with open(file_name, 'rb') as f:
+            return self.transcribe_bytes(f.read())
+
+    def transcribe_bytes(self, data: bytes) -> str:
+        """Transcribe an encoded audio file held in memory"""
+        return self._request('/transcribe', data, 'application/octet-stream')['text']
+
+    def set_param_size(self, param_size: str = 'base'):
+        self._request('/model', json.dumps({'param_size': param_size}).encode('utf-8'))
+        self.param_size = param_size
+
+    def get_voices(self) -> list:
+        return self._request('/voices')
+
+    def tts(self, text: str, voice: str) -> bytes:
+        body = json.dumps({'text': text, 'voice': voice}).encode('utf-8')
+        return self._request('/tts', body, parse_json=False)
+
+    def close(self):
+        pass
+
+    def _fetch_status(self):
+        try:
+            status = self._request('/status')
+        except RuntimeError as e:
+            print(f'S4TS service unavailable: {e}')
+            if self.error_func is not None:
+                self.error_func(f'S4TS service unavailable: {e}')
+            return
+        self.param_size = status['param_size']
+        self._cuda = status['cuda']
+        if self.ready_func is not None:
+            self.ready_func(self)
+
+    def _request(self, path: str, body: bytes = None, content_type: str = 'application/json', parse_json=True):
+        headers = {'Content-Type': content_type, 'X-Client-Id': self.client_id}
+        if self.token:
+            headers['X-S4TS-Token'] = self.token
+        request = urllib.request.Request(self.url + path, data=body, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', str(e))
+            except ValueError:
+                message = str(e)
+            raise RuntimeError(message) from e
+        except OSError as e:
+            raise RuntimeError(str(e)) from e
+        return json.loads(data) if parse_json else data
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    from configuration import ConfigFile, ConfigNode
+    from elevenlabs_tts import ElevenLabsTTS
+
+    parser = argparse.ArgumentParser(description='Serve transcription and ElevenLabs TTS to several S4TS clients')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--size', default='base')
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=50)
+    parser.add_argument('--token', help='shared secret clients must send, defaults to Server_Token in config.txt')
+    args = parser.parse_args()
+
+    config = ConfigFile('config')
+    token = args.token or config.get(ConfigNode.SERVER_TOKEN)
+    # Without a token anyone who can reach the port could spend the ElevenLabs quota or swap the model
+    if not token and args.host not in LOOPBACK_HOSTS:
+        sys.exit(f'Refusing to listen on {args.host} without a token, set Server_Token in config.txt or pass --token')
+    engine = whisper.create_engine(config.get(ConfigNode.ASR_ENGINE), args.size)
+    server = S4TSServer((args.host, args.port),
+                        BatchScheduler(engine, args.max_batch_size, args.max_wait_ms / 1000),
+                        ElevenLabsTTS(config), token)
+    print(f'S4TS service listening on {args.host}:{args.port}')
+    server.serve_forever()
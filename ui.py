@@ -1,22 +1,39 @@
-import sys
-import threading
-
-import numpy as np
-import qdarktheme
-from PySide6 import QtCore
-from PySide6.QtCore import QUrl, QObject, QRunnable, Slot
-from PySide6.QtMultimedia import QMediaPlayer, QAudioOutput, QMediaDevices
-from PySide6.QtWidgets import QMainWindow, QGridLayout, QWidget, QLabel, QApplication, QLineEdit, QComboBox, \
-    QPushButton, QCheckBox, QStatusBar, QMessageBox
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
-from matplotlib.figure import Figure
-
-import record
-import util
-import whisper
-from configuration import ConfigFile, ConfigNode
-from elevenlabs_tts import ElevenLabsTTS
-from record import Recorder
+import time
+
+# Taken before the imports below, PySide6, matplotlib and numpy are a large part of the startup time
+STARTED = time.perf_counter()
+
+import bisect  # noqa: E402
+import io  # noqa: E402
+import os  # noqa: E402
+import sqlite3  # noqa: E402
+import sys  # noqa: E402
+import threading  # noqa: E402
+
+import numpy as np  # noqa: E402
+import qdarktheme  # noqa: E402
+from PySide6 import QtCore  # noqa: E402
+from PySide6.QtCore import QObject, QRunnable, Slot  # noqa: E402
+from PySide6.QtGui import QKeySequence, QShortcut  # noqa: E402
+from PySide6.QtMultimedia import QMediaDevices, QAudioFormat  # noqa: E402
+from PySide6.QtWidgets import (  # noqa: E402
+    QMainWindow, QGridLayout, QWidget, QLabel, QApplication, QLineEdit, QComboBox, QPushButton, QCheckBox,
+    QStatusBar, QMessageBox, QDialog, QVBoxLayout, QListWidget, QListWidgetItem)
+from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg  # noqa: E402
+from matplotlib.figure import Figure  # noqa: E402
+
+import adaptive  # noqa: E402
+import benchmark  # noqa: E402
+import playback  # noqa: E402
+import util  # noqa: E402
+import whisper  # noqa: E402
+from adaptive import AdaptivePolicy  # noqa: E402
+from asr_server import ASRClient  # noqa: E402
+from configuration import ConfigFile, ConfigNode  # noqa: E402
+from elevenlabs_tts import ElevenLabsTTS  # noqa: E402
+from history import SessionHistory  # noqa: E402
+from record import AudioEngine  # noqa: E402
+from service import ServiceClient  # noqa: E402
 
 
 class MplCanvas(FigureCanvasQTAgg):
@@ -35,15 +52,52 @@ class MplCanvas(FigureCanvasQTAgg):
 
 class S4TSWorkerSignals(QObject):
     transcription_finished = QtCore.Signal(str)
-    tts_finished = QtCore.Signal()
+    tts_finished = QtCore.Signal(object)
+    error = QtCore.Signal(str)
+    model_chosen = QtCore.Signal(str)
     finished = QtCore.Signal()
 
 
+class ASRSignals(QObject):
+    ready = QtCore.Signal(str)
+    error = QtCore.Signal(str)
+    progress = QtCore.Signal(str)
+
+
+class TaskSignals(QObject):
+    finished = QtCore.Signal(object)
+    error = QtCore.Signal(str)
+
+
+class Task(QRunnable):
+    """Runs a blocking call on the thread pool and hands its result back to the GUI thread"""
+
+    def __init__(self, fn, *args):
+        super(Task, self).__init__()
+        self.fn = fn
+        self.args = args
+        self.signals = TaskSignals()
+
+    @Slot()
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            self.signals.error.emit(f'{type(e).__name__}: {e}')
+            return
+        self.signals.finished.emit(result)
+
+
 class S4TSWorker(QRunnable):
 
-    def __init__(self, stt_file: str, tts: ElevenLabsTTS, voice: str, *args, **kwargs):
+    def __init__(self, recording: bytes, asr: ASRClient, tts: ElevenLabsTTS, voice: str, audio_format: QAudioFormat,
+                 policy: AdaptivePolicy = None, history: SessionHistory = None, *args, **kwargs):
         super(S4TSWorker, self).__init__()
-        self.stt_file = stt_file
+        self.recording = recording
+        self.audio_format = audio_format
+        self.asr = asr
+        self.policy = policy
+        self.history = history
         self.tts = tts
         self.voice = voice
         # Add the callback to our kwargs
@@ -53,10 +107,72 @@ class S4TSWorker(QRunnable):
 
     @Slot()
     def run(self):
-        text = whisper.transcribe(self.stt_file)
+        # Any error has to reach the status bar, an exception escaping run() would go unnoticed
+        try:
+            text = self.asr.transcribe_bytes(self.recording) if self.policy is None else self.adaptive_transcribe()
+        except Exception as e:
+            self.signals.error.emit(f'Transcription failed: {type(e).__name__}: {e}')
+            return
         self.signals.transcription_finished.emit(text)
-        self.tts.tts(text, self.voice)
-        self.signals.tts_finished.emit()
+        try:
+            data = self.tts.tts(text, self.voice)
+            clip = playback.prepare_clip(data, self.audio_format)
+        except Exception as e:
+            self.signals.error.emit(f'Speech synthesis failed: {type(e).__name__}: {e}')
+            return
+        self.signals.tts_finished.emit(clip)
+        if self.history is not None:
+            try:
+                self.history.add(self.recording, text, self.voice, data)
+            except (OSError, RuntimeError, sqlite3.Error) as e:
+                print(f'Could not save take to history: {e}')
+        self.signals.finished.emit()
+
+    def adaptive_transcribe(self) -> str:
+        audio = whisper.load_audio(io.BytesIO(self.recording))
+        duration = len(audio) / whisper.SAMPLE_RATE
+        size = self.policy.choose(duration)
+        text, elapsed = self.asr.transcribe_timed(audio, size)
+        self.policy.record(size, duration, elapsed)
+        self.signals.model_chosen.emit(f'{size} · {elapsed:.1f}s for {duration:.1f}s')
+        return text
+
+
+class HistoryDialog(QDialog):
+    """Search past takes by transcript and replay their synthesized audio"""
+
+    def __init__(self, history: SessionHistory, replay_func, parent=None):
+        super(HistoryDialog, self).__init__(parent)
+        self.history = history
+        self.replay_func = replay_func
+        self.setWindowTitle("History")
+
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search transcripts")
+        self.search_input.textChanged.connect(self.refresh)
+        self.takes_list = QListWidget()
+        self.takes_list.itemActivated.connect(self.on_take_activated)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.search_input)
+        layout.addWidget(self.takes_list)
+        self.setLayout(layout)
+        self.resize(420, 300)
+
+    def refresh(self):
+        self.takes_list.clear()
+        for take in self.history.search(self.search_input.text()):
+            created = time.strftime('%m/%d %H:%M', time.localtime(take.created))
+            item = QListWidgetItem(f'{created}  {take.transcript}')
+            item.setData(QtCore.Qt.ItemDataRole.UserRole, take)
+            self.takes_list.addItem(item)
+
+    def showEvent(self, event):
+        self.refresh()
+        super(HistoryDialog, self).showEvent(event)
+
+    def on_take_activated(self, item: QListWidgetItem):
+        self.replay_func(item.data(QtCore.Qt.ItemDataRole.UserRole))
 
 
 class ElevensLabS4TS(QMainWindow):
@@ -67,11 +183,42 @@ class ElevensLabS4TS(QMainWindow):
         self.is_flattening = False
 
         self.last_wave = None
+        self.tts = None
+        self.voice_combo = None
+        self.audio_engine = None
+        # The plot, output devices and player are set up once the window is on screen
+        self.plot = None
+        self.player = None
+        self.is_refreshing_devices = False
+        self.refresh_pending = False
+        # Slow startup work runs in the background, the window is ready once all of these report back
+        self.startup_pending = {'devices', 'model'}
+        self.startup_failed = False
+        self.window_time = None
 
-        self.recFile = None
-        self.config = ConfigFile('config')
+        self.status_bar = QStatusBar()
+        self.status_bar.showMessage('Loading speech recognition model...')
+        self.model_status = QLabel()
+        self.status_bar.addPermanentWidget(self.model_status)
 
-        self.recorder = Recorder(channels=1, rate=16000, frames_per_buffer=1024, update_func=self.update_plot)
+        self.config = ConfigFile('config')
+        self.asr_signals = ASRSignals()
+        self.asr_signals.ready.connect(self.on_asr_ready)
+        self.asr_signals.error.connect(self.on_asr_error)
+        self.asr_signals.progress.connect(self.status_bar.showMessage)
+        self.is_profiling = False
+        self.server = self.config.get(ConfigNode.SERVER)
+        if self.server:
+            # Thin client, transcription and speech synthesis both run on the S4TS service
+            self.asr = ServiceClient(self.server, self.config.get(ConfigNode.SERVER_TOKEN),
+                                     ready_func=self.emit_asr_ready, error_func=self.asr_signals.error.emit)
+        else:
+            self.asr = ASRClient(self.config.get(ConfigNode.ASR_ENGINE), ready_func=self.emit_asr_ready,
+                                 error_func=self.asr_signals.error.emit)
+        profile_path = os.path.join(os.getcwd(), f'model_profile_{self.config.get(ConfigNode.ASR_ENGINE)}.json')
+        self.policy = AdaptivePolicy(float(self.config.get(ConfigNode.LATENCY_BUDGET)), path=profile_path)
+        self.history = SessionHistory(quota_mb=float(self.config.get(ConfigNode.HISTORY_QUOTA_MB)))
+        self.history_dialog = HistoryDialog(self.history, self.replay_take, self)
 
         self.setWindowTitle("ElevenLabsS4TS")
 
@@ -79,30 +226,38 @@ class ElevensLabS4TS(QMainWindow):
 
         # Create widgets
         api_key_label = QLabel("API Key")
-        self._setup_player()
 
         self.api_key_input = QLineEdit()
         self.api_key_input.setEchoMode(QLineEdit.EchoMode.Password)
-        if self._set_up_key():
+        if self.server:
+            self.api_key_input.setPlaceholderText(f"Provided by {self.server}")
+            self.api_key_input.setDisabled(True)
+            self._setup_voice()
+        elif self._set_up_key():
             self._setup_voice()
         else:
             self.api_key_input.setPlaceholderText("Enter your API key")
+        if not self.server:
+            # Also used to correct the key when loading voices fails
             self.api_key_input.returnPressed.connect(self.on_api_key_input)
 
         device_label = QLabel("Input")
         self.device_combo = QComboBox()
-        self.input_devices = record.get_audio_devices()
-        self._fix_input_names()
-        self.device_combo.addItems(self.input_devices)
-        self.change_if_config_set(self.config.get(ConfigNode.INPUT), self.device_combo)
+        self.device_combo.setPlaceholderText("Loading devices...")
         self.device_combo.currentTextChanged.connect(self.on_device_combo_name_changed)
+        self.start_task(self.on_audio_engine_ready, AudioEngine, 1, 16000, 1024, 0.3, self.update_plot)
+        # Devices often change several times in a row when plugged in, refresh once they settle
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(300)
+        self.refresh_timer.timeout.connect(self.refresh_input_devices)
+        self.media_devices = QMediaDevices()
+        self.media_devices.audioInputsChanged.connect(self.refresh_timer.start)
 
         self.output_label = QLabel("Output")
         self.output_combo = QComboBox()
-        self.audio_output_devices = QMediaDevices.audioOutputs()
-        self.output_combo.addItems([device.description() for device in self.audio_output_devices])
-        self.change_if_config_set(self.config.get(ConfigNode.OUTPUT), self.output_combo)
-        self.output_combo.currentIndexChanged.connect(self.on_output_combo_index_changed)
+        self.output_combo.setPlaceholderText("Loading devices...")
+        self.audio_output_devices = []
 
         self.transcript_mode_label = QLabel("Transcript Mode")
         self.transcript_mode_checkbox = QCheckBox()
@@ -113,24 +268,33 @@ class ElevensLabS4TS(QMainWindow):
         self.use_medium_model_checkbox = QCheckBox()
         self.use_medium_model_checkbox.stateChanged.connect(self.on_use_medium_model_checkbox)
 
+        self.adaptive_model_label = QLabel("Adaptive Model")
+        self.adaptive_model_checkbox = QCheckBox()
+        self.adaptive_model_checkbox.setToolTip(f'Pick the largest model that transcribes within '
+                                                f'{self.policy.budget:g}s, measured on this machine')
+        if self.server:
+            # The model belongs to the service and is shared with every client, so it is not switched from here
+            self.adaptive_model_checkbox.setDisabled(True)
+            self.use_medium_model_checkbox.setDisabled(True)
+            self.use_medium_model_checkbox.setToolTip(f'The model is chosen on {self.server}')
+        else:
+            self.change_if_config_set(self.config.get(ConfigNode.ADAPTIVE), self.adaptive_model_checkbox)
+            self.use_medium_model_checkbox.setDisabled(self.adaptive_model_checkbox.isChecked())
+        self.adaptive_model_checkbox.stateChanged.connect(self.on_adaptive_model_checkbox)
+
         self.record_button = QPushButton("Record")
+        self.record_button.setDisabled(True)
         self.record_button.pressed.connect(self.on_record_button)
         self.record_button.released.connect(self.on_stop_button)
 
-        self.plot = MplCanvas(self, width=5, height=1, dpi=100)
-        x = [i for i in range(0, 1024)]
-        y = [util.pretty_wave(x) for x in range(0, 1024)]
-        y_max = max([max(y), 4000])
-        self.plot.axes.set_ylim(-y_max, y_max)
-        self.gradient = util.calculate_gradient_str('0x2b5876', '0x4e4376', 1024)
-        self.plot.axes.scatter(x, y, c=self.gradient, s=2)
+        self.plot_area = QWidget()
+        self.plot_area.setLayout(QVBoxLayout())
+        self.plot_area.layout().setContentsMargins(0, 0, 0, 0)
 
         self.transcript = QLabel("Transcription")
         self.transcription_preview = QLineEdit()
         self.transcription_preview.setReadOnly(True)
 
-        self.status_bar = QStatusBar()
-
         # Set layout
         self.layout.addWidget(api_key_label, 0, 0)
         self.layout.addWidget(self.api_key_input, 0, 1)
@@ -146,12 +310,17 @@ class ElevensLabS4TS(QMainWindow):
         toggle_layout.addWidget(self.transcript_mode_checkbox, 0, 1)
         toggle_layout.addWidget(self.use_medium_model_label, 0, 2)
         toggle_layout.addWidget(self.use_medium_model_checkbox, 0, 3)
+        toggle_layout.addWidget(self.adaptive_model_label, 1, 0)
+        toggle_layout.addWidget(self.adaptive_model_checkbox, 1, 1)
+        self.history_button = QPushButton("History")
+        self.history_button.clicked.connect(self.history_dialog.show)
+        toggle_layout.addWidget(self.history_button, 1, 2, 1, 2)
 
         self.layout.addLayout(toggle_layout, 4, 0, 1, 2)
 
         self.layout.addWidget(self.record_button, 5, 0, 1, 2)
 
-        self.layout.addWidget(self.plot, 6, 0, 1, 2)
+        self.layout.addWidget(self.plot_area, 6, 0, 1, 2)
 
         self.layout.addWidget(self.transcript, 7, 0)
         self.layout.addWidget(self.transcription_preview, 8, 0, 1, 2)
@@ -161,14 +330,39 @@ class ElevensLabS4TS(QMainWindow):
         self.widget.setLayout(self.layout)
         self.setCentralWidget(self.widget)
         self.setStatusBar(self.status_bar)
-        self.setFixedSize(420, 370)
+        self.setFixedSize(420, 395)
         self.show()
+        QtCore.QTimer.singleShot(0, self.on_window_shown)
+
+        if self.adaptive_model_checkbox.isChecked() and not self.policy.is_profiled():
+            self.start_profiling()
+
+    def _setup_plot(self):
+        self.plot = MplCanvas(self, width=5, height=1, dpi=100)
+        x = np.arange(0, 1024)
+        y = util.pretty_wave(x)
+        y_max = max([max(y), 4000])
+        self.plot.axes.set_ylim(-y_max, y_max)
+        self.gradient = util.calculate_gradient_str('0x2b5876', '0x4e4376', 1024)
+        self.plot.axes.scatter(x, y, c=self.gradient, s=2)
+        self.plot_area.layout().addWidget(self.plot)
+
+    def _setup_output(self):
+        self.audio_output_devices = QMediaDevices.audioOutputs()
+        self.output_combo.addItems([device.description() for device in self.audio_output_devices])
+        self.change_if_config_set(self.config.get(ConfigNode.OUTPUT), self.output_combo)
+        self.output_combo.currentIndexChanged.connect(self.on_output_combo_index_changed)
 
     def _setup_player(self):
-        self.media_player = QMediaPlayer()
-        self.output = QAudioOutput()
-        self.output.setVolume(1.0)
-        self.media_player.setAudioOutput(self.output)
+        device = None
+        if 0 <= self.output_combo.currentIndex() < len(self.audio_output_devices):
+            device = self.audio_output_devices[self.output_combo.currentIndex()]
+        self.player = playback.PlaybackEngine(device, parent=self)
+        self.player.queue_empty.connect(lambda: self.status_bar.showMessage('Playback finished'))
+        self.interrupt_shortcut = QShortcut(QKeySequence("Ctrl+Right"), self)
+        self.interrupt_shortcut.activated.connect(self.player.interrupt)
+        self.flush_shortcut = QShortcut(QKeySequence("Esc"), self)
+        self.flush_shortcut.activated.connect(self.player.flush)
 
     def _set_up_key(self) -> bool:
         key = self.config.get(ConfigNode.API_KEY)
@@ -178,14 +372,66 @@ class ElevensLabS4TS(QMainWindow):
             return True
         return False
 
+    def start_task(self, on_finished, fn, *args, on_error=None):
+        task = Task(fn, *args)
+        task.signals.finished.connect(on_finished)
+        task.signals.error.connect(on_error or self.status_bar.showMessage)
+        self.threadpool.start(task)
+
+    def on_window_shown(self):
+        self.window_time = time.perf_counter() - STARTED
+        print(f'Time to window: {self.window_time:.2f}s')
+        # Matplotlib drawing and opening the output device would otherwise delay the first paint
+        self._setup_plot()
+        self._setup_output()
+        self._setup_player()
+        self._enable_record()
+
+    def _enable_record(self):
+        ready = self.audio_engine is not None and self.player is not None and not self.is_refreshing_devices
+        self.record_button.setDisabled(not ready)
+        self.device_combo.setDisabled(self.is_refreshing_devices)
+
+    def startup_done(self, name: str, failed: bool = False):
+        if name not in self.startup_pending:
+            return
+        self.startup_pending.discard(name)
+        # A failed step keeps its error message on the status bar instead of reporting ready
+        self.startup_failed = self.startup_failed or failed
+        if not self.startup_pending and not self.startup_failed:
+            ready_time = time.perf_counter() - STARTED
+            window_time = ready_time if self.window_time is None else self.window_time
+            print(f'Time to ready: {ready_time:.2f}s')
+            self.status_bar.showMessage(f'Ready in {ready_time:.1f}s (window in {window_time:.1f}s)')
+
+    def on_audio_engine_ready(self, audio_engine: AudioEngine):
+        self.audio_engine = audio_engine
+        self._populate_input_combo(self.audio_engine.get_audio_devices())
+        self._enable_record()
+        self.startup_done('devices')
+        self._run_pending_refresh()
+
+    def _populate_input_combo(self, devices: list[str]):
+        self.input_devices = devices
+        self._fix_input_names()
+        self.device_combo.blockSignals(True)
+        self.device_combo.clear()
+        self.device_combo.addItems(self.input_devices)
+        self.change_if_config_set(self.config.get(ConfigNode.INPUT), self.device_combo)
+        self.device_combo.blockSignals(False)
+        self.audio_engine.select_input(self.device_combo.currentIndex())
+
     def _fix_input_names(self):
-        named_devices = [device.description() for device in QMediaDevices.audioInputs()]
-        for i in self.input_devices:
-            for j in named_devices:
-                if j.startswith(i):
-                    self.input_devices[self.input_devices.index(i)] = j
+        # PortAudio may truncate names, so each one is matched to the Qt name it is a prefix of
+        named_devices = sorted(device.description() for device in QMediaDevices.audioInputs())
+        for position, name in enumerate(self.input_devices):
+            match = bisect.bisect_left(named_devices, name)
+            if match < len(named_devices) and named_devices[match].startswith(name):
+                self.input_devices[position] = named_devices[match]
 
     def update_plot(self, input_data):
+        if self.plot is None:
+            return
         self.plot.axes.cla()  # Clear the canvas.
         self.plot.axes.margins(0, 0, tight=True)
         self.plot.axes.axis('off')
@@ -218,23 +464,83 @@ class ElevensLabS4TS(QMainWindow):
         thread.start()
 
     def _setup_voice(self):
-        self.tts = ElevenLabsTTS(self.config)
-        self.voice_label = QLabel("Voice")
-        self.voice_combo = QComboBox()
-        self.voice_combo.addItems(self.tts.get_voices())
+        if self.voice_combo is None:
+            self.startup_pending.add('voices')
+            self.voice_label = QLabel("Voice")
+            self.voice_combo = QComboBox()
+            self.voice_combo.currentIndexChanged.connect(self.on_voice_combo_index_changed)
+            self.layout.addWidget(self.voice_label, 3, 0)
+            self.layout.addWidget(self.voice_combo, 3, 1)
+        self.voice_combo.setPlaceholderText("Loading voices...")
+        self.voice_combo.setDisabled(True)
+        self.start_task(self.on_voices_loaded, self.load_voices, on_error=self.on_voices_failed)
+
+    def load_voices(self) -> tuple:
+        tts = self.asr if self.server else ElevenLabsTTS(self.config)
+        return tts, tts.get_voices()
+
+    def on_voices_loaded(self, result: tuple):
+        self.tts, voices = result
+        self.voice_combo.blockSignals(True)
+        self.voice_combo.clear()
+        self.voice_combo.addItems(voices)
         self.change_if_config_set(self.config.get(ConfigNode.VOICE), self.voice_combo)
-        self.voice_combo.currentIndexChanged.connect(self.on_voice_combo_index_changed)
-        self.layout.addWidget(self.voice_label, 3, 0)
-        self.layout.addWidget(self.voice_combo, 3, 1)
+        self.voice_combo.blockSignals(False)
+        self.voice_combo.setDisabled(False)
+        self.startup_done('voices')
+
+    def on_voices_failed(self, message: str):
+        self.voice_combo.setPlaceholderText("No voices")
+        self.startup_done('voices', failed=True)
+        if self.server:
+            self.status_bar.showMessage(f'Could not load voices from {self.server}, retrying in 10s: {message}')
+            QtCore.QTimer.singleShot(10000, self._setup_voice)
+        else:
+            # The key may be wrong, so it can be entered again
+            self.api_key_input.setDisabled(False)
+            self.status_bar.showMessage(f'Could not load voices, check the API key and press Enter: {message}')
 
     def on_device_combo_name_changed(self):
         curr_name = self.device_combo.currentText()
         self.config.set(ConfigNode.INPUT, curr_name)
+        if self.audio_engine is not None:
+            self.audio_engine.select_input(self.device_combo.currentIndex())
+
+    def refresh_input_devices(self):
+        if self.is_recording or self.is_refreshing_devices or self.audio_engine is None:
+            # Picked up again once the recording, refresh or engine startup is done
+            self.refresh_pending = True
+            return
+        self.is_refreshing_devices = True
+        self._enable_record()
+        # Restarting PortAudio is slow, so it happens on the thread pool as well
+        self.start_task(self.on_input_devices_refreshed, self.audio_engine.refresh_devices,
+                        on_error=self.on_input_devices_refresh_failed)
+
+    def on_input_devices_refreshed(self, devices: list[str]):
+        self.is_refreshing_devices = False
+        self._populate_input_combo(devices)
+        self._enable_record()
+        self._run_pending_refresh()
+
+    def on_input_devices_refresh_failed(self, message: str):
+        self.is_refreshing_devices = False
+        self._enable_record()
+        self.status_bar.showMessage(f'Could not refresh input devices: {message}')
+
+    def _run_pending_refresh(self):
+        if self.refresh_pending:
+            self.refresh_pending = False
+            self.refresh_timer.start()
 
     def on_output_combo_index_changed(self):
         device = self.audio_output_devices[self.output_combo.currentIndex()]
-        self.output.setDevice(device)
+        queued = self.player.set_device(device)
         self.config.set(ConfigNode.OUTPUT, device.description())
+        if queued:
+            # Resampling the queue for the new device is as slow as preparing the clips was
+            self.start_task(lambda result: self.player.requeue(*result), playback.convert_clips, queued,
+                            QAudioFormat(self.player.format))
 
     def on_voice_combo_index_changed(self):
         self.config.set(ConfigNode.VOICE, self.voice_combo.currentText())
@@ -249,40 +555,65 @@ class ElevensLabS4TS(QMainWindow):
                 widget.setCurrentIndex(widget_index)
 
     def on_record_button(self):
-        self.recFile = self.recorder.open('recorded.wav', 'wb')
-        self.recFile.start_recording(self.device_combo.currentIndex())
+        self.audio_engine.start_recording('recorded.wav', 'wb')
         self.is_recording = True
 
     def on_stop_button(self):
-        if self.recFile is None:
+        if self.audio_engine.stop_recording() is None:
             return
-        self.recFile.stop_recording()
         self.is_recording = False
+        self._run_pending_refresh()
         self.status_bar.showMessage('Transcribing...')
         self.wave_flattener()
         self.s4ts('recorded.wav')
 
     def s4ts(self, file: str):
-        worker = S4TSWorker(file, self.tts, self.voice_combo.currentText())
+        if self.tts is None:
+            self.status_bar.showMessage('Voices are not loaded yet')
+            return
+        # Read here rather than in the worker, which may start after the next take has overwritten the file
+        with open(file, 'rb') as f:
+            recording = f.read()
+        policy = self.policy if self.adaptive_model_checkbox.isChecked() else None
+        worker = S4TSWorker(recording, self.asr, self.tts, self.voice_combo.currentText(),
+                            QAudioFormat(self.player.format), policy, self.history)
+        worker.signals.model_chosen.connect(self.model_status.setText)
         worker.signals.transcription_finished.connect(self.notify_transcription_done)
         worker.signals.tts_finished.connect(self.play_audio)
+        worker.signals.error.connect(self.status_bar.showMessage)
+        worker.signals.finished.connect(self.on_take_finished)
         self.threadpool.start(worker)
 
+    def on_take_finished(self):
+        # Without a corpus the first takes are what the adaptive profile gets measured on
+        if self.adaptive_model_checkbox.isChecked() and not self.policy.is_profiled():
+            self.start_profiling()
+
+    def replay_take(self, take):
+        if self.player is None:
+            self.status_bar.showMessage('Playback is not ready yet')
+            return
+
+        def on_clip_ready(clip: tuple):
+            self.transcription_preview.setText(take.transcript)
+            self.status_bar.showMessage('Replaying from history')
+            self.player.enqueue(*clip)
+
+        self.start_task(on_clip_ready, self.load_take_clip, take.id, QAudioFormat(self.player.format))
+
+    def load_take_clip(self, take_id: int, audio_format: QAudioFormat) -> tuple:
+        return playback.prepare_clip(self.history.output(take_id), audio_format)
+
     def notify_transcription_done(self, text: str):
         self.transcription_preview.setText(text)
         self.status_bar.showMessage('Transcription done')
 
-    def play_audio(self):
+    def play_audio(self, clip: tuple):
         if self.transcript_mode_checkbox.isChecked():
             return
 
         self.status_bar.showMessage('Playing audio')
-        print(f'Media player status: {self.media_player.mediaStatus()}')
-        self.media_player.setSource(QUrl.fromLocalFile('elevenlabs.wav'))
-        self.media_player.setSource('elevenlabs.wav')
-        self.media_player.setPosition(0)
-        print(f'Media player status: {self.media_player.mediaStatus()}')
-        self.media_player.play()
+        self.player.enqueue(*clip)
 
     def on_use_transcript_mode_checkbox(self):
         checked = self.transcript_mode_checkbox.isChecked()
@@ -294,7 +625,7 @@ class ElevensLabS4TS(QMainWindow):
 
     def on_use_medium_model_checkbox(self):
         checked = self.use_medium_model_checkbox.isChecked()
-        if not whisper.is_cuda() and checked:
+        if not self.asr.is_cuda() and checked:
             message_box = QMessageBox()
             message_box.setIcon(QMessageBox.Icon.Warning)
             message_box.setWindowTitle('Warning')
@@ -304,18 +635,91 @@ class ElevensLabS4TS(QMainWindow):
             if message_box.exec() == QMessageBox.StandardButton.No:
                 self.use_medium_model_checkbox.setChecked(False)
                 return
-        self.status_bar.showMessage('Changing model, this may take a while...')
-        thread = threading.Thread(target=self.model_changed_thread, args=(checked,))
-        thread.start()
+        self.change_model(checked)
 
-    def model_changed_thread(self, checked: bool):
-        def thread_target():
-            param = 'medium' if checked else 'base'
-            whisper.set_param_size(param)
-            self.status_bar.showMessage(f'Model changed to {param}')
+    def change_model(self, medium: bool):
+        self.status_bar.showMessage('Changing model, this may take a while...')
+        param = 'medium' if medium else 'base'
+        # The model is loaded by the ASR worker process, the pool thread only waits for it
+        self.start_task(self.on_model_changed, self.asr.set_param_size, param,
+                        on_error=lambda message: self.status_bar.showMessage(f'Could not change model: {message}'))
+
+    def on_model_changed(self, _):
+        self.status_bar.showMessage(f'Model changed to {self.asr.param_size}')
+
+    def on_adaptive_model_checkbox(self):
+        checked = self.adaptive_model_checkbox.isChecked()
+        self.config.set(ConfigNode.ADAPTIVE, checked)
+        self.use_medium_model_checkbox.setDisabled(checked)
+        if checked:
+            if not self.policy.is_profiled():
+                self.start_profiling()
+            else:
+                self.status_bar.showMessage(f'Adaptive model selection, budget {self.policy.budget:g}s')
+        else:
+            self.model_status.clear()
+            # Switching back to a single model also unloads the extra sizes from the worker
+            self.change_model(self.use_medium_model_checkbox.isChecked())
 
-        thread = threading.Thread(target=thread_target)
-        thread.start()
+    def start_profiling(self):
+        if self.is_profiling:
+            return
+        self.is_profiling = True
+        self.start_task(self.on_profiled, self.run_profiling, on_error=self.on_profiling_failed)
+
+    def run_profiling(self) -> bool:
+        utterances = self.profiling_speech()
+        if len(utterances) < adaptive.MIN_PROFILE_UTTERANCES:
+            return False
+        self.policy.profile(self.asr, utterances, progress_func=self.asr_signals.progress.emit)
+        return True
+
+    def profiling_speech(self, limit: int = 12) -> list[np.ndarray]:
+        """Real speech to profile on, the benchmark corpus if its audio is there and past takes otherwise"""
+        if os.path.exists(os.path.join(benchmark.CORPUS_DIR, benchmark.TRANSCRIPTS)):
+            corpus = benchmark.load_corpus()
+            if corpus:
+                return [audio for audio, _ in corpus[:limit]]
+        utterances = []
+        for take in self.history.search(limit=limit):
+            try:
+                utterances.append(whisper.load_audio(self.history.input_path(take.id)))
+            except (KeyError, OSError, RuntimeError) as e:
+                print(f'Skipping take {take.id} for profiling: {e}')
+        return utterances
+
+    def on_profiled(self, profiled: bool):
+        self.is_profiling = False
+        if not profiled:
+            self.status_bar.showMessage(f'Adaptive model is profiled once you have '
+                                        f'{adaptive.MIN_PROFILE_UTTERANCES} takes')
+            return
+        summary = ', '.join(f'{size} RTF {self.policy.real_time_factor(size, 5):.2f}'
+                            for size in self.policy.sizes)
+        self.status_bar.showMessage(f'Profiled at 5s: {summary}')
+
+    def on_profiling_failed(self, message: str):
+        self.is_profiling = False
+        self.status_bar.showMessage(f'Profiling failed: {message}')
+
+    def emit_asr_ready(self, client):
+        # Called from the client's own thread, the signal hands it over to the GUI thread
+        self.asr_signals.ready.emit(client.param_size)
+
+    def on_asr_ready(self, param_size: str):
+        self.status_bar.showMessage(f'Model {param_size} ready')
+        self.startup_done('model')
+
+    def on_asr_error(self, message: str):
+        self.startup_done('model', failed=True)
+        self.status_bar.showMessage(f'Speech recognition unavailable: {message}')
+
+    def closeEvent(self, event):
+        if self.audio_engine is not None:
+            self.audio_engine.close()
+        self.asr.close()
+        self.history.close()
+        super(ElevensLabS4TS, self).closeEvent(event)
 
     def on_api_key_input(self):
         self.api_key_input.setDisabled(True)
@@ -1,35 +1,216 @@
-import torch
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
 import soundfile as sf
-from transformers import WhisperProcessor, WhisperForConditionalGeneration, WhisperTokenizerFast
 
-# load model and processor
-tokenizer = WhisperTokenizerFast.from_pretrained('openai/whisper-base')
-processor = WhisperProcessor.from_pretrained('openai/whisper-base', tokenizer=tokenizer)
-model = WhisperForConditionalGeneration.from_pretrained("openai/whisper-base")
+SAMPLE_RATE = 16000
+
+
+def load_audio(file_name: str) -> np.ndarray:
+    """Read an audio file as mono float32 at 16 kHz, which is what every Whisper backend expects"""
+    audio, sample_rate = sf.read(file_name, dtype='float32')
+    return to_model_input(audio, sample_rate)
+
+
+def to_model_input(audio: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Downmix and resample a buffer to mono float32 at 16 kHz"""
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    if sample_rate != SAMPLE_RATE:
+        import librosa
+        audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=SAMPLE_RATE)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+class ASREngine(ABC):
+    """
+    Common interface for the speech recognition backends.
+
+    The UI only talks to this interface, so a backend can be swapped through
+    the ``ASR_Engine`` config node without touching the rest of the application.
+
+    ``device`` and ``precision`` default to the fastest setting the machine
+    supports, ``precisions`` lists what each device accepts.
+    """
+    name = None
+    precisions = {}
+
+    def __init__(self, param_size: str = 'base', beam_size: int = 1):
+        self.param_size = param_size
+        self.beam_size = beam_size
+        self.load(param_size)
+
+    @staticmethod
+    @abstractmethod
+    def cuda_available() -> bool:
+        pass
+
+    @abstractmethod
+    def load(self, param_size: str) -> None:
+        """Load the model weights for the given Whisper size"""
+        pass
+
+    @abstractmethod
+    def is_cuda(self) -> bool:
+        pass
+
+    @abstractmethod
+    def transcribe_audio(self, audio: np.ndarray) -> str:
+        """Transcribe a mono float32 buffer sampled at 16 kHz"""
+        pass
+
+    def transcribe_batch(self, audios: list[np.ndarray]) -> list[str]:
+        """Transcribe several buffers at once, backends that can batch on the model override this"""
+        return [self.transcribe_audio(audio) for audio in audios]
+
+    def transcribe(self, file_name: str) -> str:
+        return self.transcribe_audio(load_audio(file_name)).strip()
+
+    def set_param_size(self, param_size: str = 'base'):
+        self.load(param_size)
+        self.param_size = param_size
+
+
+class TransformersEngine(ASREngine):
+    """Hugging Face ``WhisperForConditionalGeneration`` backend, uses CUDA when available"""
+    name = 'transformers'
+    precisions = {'cpu': ('float32',), 'cuda': ('float32', 'float16')}
+
+    def __init__(self, param_size: str = 'base', device: str = None, precision: str = 'float32', beam_size: int = 1):
+        import torch
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        self.dtype = getattr(torch, precision)
+        print('Using device: ', self.device)
+        self.model = None
+        self.processor = None
+        super().__init__(param_size, beam_size)
+
+    @staticmethod
+    def cuda_available() -> bool:
+        import torch
+        return torch.cuda.is_available()
+
+    def load(self, param_size: str) -> None:
+        from transformers import WhisperProcessor, WhisperForConditionalGeneration, WhisperTokenizerFast
+        tokenizer = WhisperTokenizerFast.from_pretrained(f'openai/whisper-{param_size}')
+        processor = WhisperProcessor.from_pretrained(f'openai/whisper-{param_size}', tokenizer=tokenizer)
+        model = WhisperForConditionalGeneration.from_pretrained(f'openai/whisper-{param_size}', torch_dtype=self.dtype)
+        model.to(self.device)
+        model.config.forced_decoder_ids = None
+        self.model, self.processor = model, processor
+
+    def is_cuda(self) -> bool:
+        print('Using device: ', self.device)
+        return self.device.type == 'cuda'
+
+    def transcribe_audio(self, audio: np.ndarray) -> str:
+        input_features = self.processor(audio, sampling_rate=SAMPLE_RATE,
+                                        return_tensors="pt").input_features.to(self.device, self.dtype)
+        predicted_ids = self.model.generate(input_features, max_length=1000, num_beams=self.beam_size)
+        return self.processor.batch_decode(predicted_ids, skip_special_tokens=True)[0]
+
+    def transcribe_batch(self, audios: list[np.ndarray]) -> list[str]:
+        # Every input is padded to Whisper's 30 second window, so they stack into one generate call
+        input_features = self.processor(audios, sampling_rate=SAMPLE_RATE,
+                                        return_tensors="pt").input_features.to(self.device, self.dtype)
+        predicted_ids = self.model.generate(input_features, max_length=1000, num_beams=self.beam_size)
+        return self.processor.batch_decode(predicted_ids, skip_special_tokens=True)
+
+
+class FasterWhisperEngine(ASREngine):
+    """
+    CTranslate2 backend through ``faster-whisper``.
+
+    On CPU the weights are quantized to int8, which is several times faster than
+    the transformers backend and uses a fraction of the memory.
+    """
+    name = 'faster-whisper'
+    precisions = {'cpu': ('int8', 'float32'), 'cuda': ('float16', 'int8_float16', 'float32')}
+
+    def __init__(self, param_size: str = 'base', device: str = None, precision: str = None, beam_size: int = 1):
+        self.device = device or ('cuda' if self.cuda_available() else 'cpu')
+        self.compute_type = precision or self.precisions[self.device][0]
+        print('Using device: ', self.device)
+        self.model = None
+        super().__init__(param_size, beam_size)
+
+    @staticmethod
+    def cuda_available() -> bool:
+        import ctranslate2
+        return ctranslate2.get_cuda_device_count() > 0
+
+    def load(self, param_size: str) -> None:
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(param_size, device=self.device, compute_type=self.compute_type)
+
+    def is_cuda(self) -> bool:
+        print('Using device: ', self.device)
+        return self.device == 'cuda'
+
+    def transcribe_audio(self, audio: np.ndarray) -> str:
+        # No VAD filter and no conditioning on previous text to match the transformers backend
+        segments, _ = self.model.transcribe(audio, beam_size=self.beam_size, condition_on_previous_text=False)
+        return ''.join(segment.text for segment in segments)
+
+
+ENGINES = {engine.name: engine for engine in (TransformersEngine, FasterWhisperEngine)}
+
+
+def create_engine(name: str = 'transformers', param_size: str = 'base', **kwargs) -> ASREngine:
+    """Create an engine by name, ``kwargs`` are ``device``, ``precision`` and ``beam_size``"""
+    if name not in ENGINES:
+        raise ValueError(f"Unknown ASR engine '{name}', expected one of {', '.join(ENGINES)}")
+    return ENGINES[name](param_size, **kwargs)
+
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print('Using device: ', device)
-model.to(device)
+def normalize_text(text: str) -> str:
+    """
+    Lowercase and strip punctuation so transcripts from different backends can be compared.
 
-model.config.forced_decoder_ids = None
+    Punctuation separates words, so "twenty-five" matches "twenty five", while
+    apostrophes inside a word are kept and "it's" stays distinct from "its".
+    """
+    text = text.lower().replace('\u2019', "'")
+    words = ''.join(c if c.isalnum() or c == "'" else ' ' for c in text).split()
+    return ' '.join(word.strip("'") for word in words if word.strip("'"))
 
 
-def is_cuda():
-    print('Using device: ', device)
-    return device.type == 'cuda'
+def cross_check(file_names: list[str], engine_names: list[str] = None, param_size: str = 'base') -> dict:
+    """
+    Run the same files through several backends and report whether their
+    transcripts agree along with load and transcription times.
+    """
+    engine_names = engine_names or list(ENGINES)
+    results = {}
+    for name in engine_names:
+        start = time.perf_counter()
+        engine = create_engine(name, param_size)
+        load_time = time.perf_counter() - start
+        transcripts, elapsed = [], 0.0
+        for file_name in file_names:
+            audio = load_audio(file_name)
+            start = time.perf_counter()
+            transcripts.append(engine.transcribe_audio(audio).strip())
+            elapsed += time.perf_counter() - start
+        results[name] = {'load_time': load_time, 'transcribe_time': elapsed, 'transcripts': transcripts}
+    reference = results[engine_names[0]]['transcripts']
+    for name in engine_names:
+        results[name]['matches_reference'] = [normalize_text(a) == normalize_text(b) for a, b in
+                                              zip(results[name]['transcripts'], reference)]
+    return results
 
 
-def transcribe(file_name: str) -> str:
-    audio, sample_rate = sf.read(file_name)
-    input_features = processor(audio, sampling_rate=sample_rate, return_tensors="pt").input_features.to(device)
-    predicted_ids = model.generate(input_features, max_length=1000)
-    transcription: str = processor.batch_decode(predicted_ids, skip_special_tokens=True)[0]
-    return transcription.strip()
+if __name__ == '__main__':
+    import argparse
 
+    parser = argparse.ArgumentParser(description='Cross-check ASR backends for output parity and speed')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--size', default='base')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    args = parser.parse_args()
 
-def set_param_size(param_size: str = 'base'):
-    global model, processor, tokenizer
-    tokenizer = WhisperTokenizerFast.from_pretrained(f'openai/whisper-{param_size}')
-    processor = WhisperProcessor.from_pretrained(f'openai/whisper-{param_size}', tokenizer=tokenizer)
-    model = WhisperForConditionalGeneration.from_pretrained(f'openai/whisper-{param_size}')
-    model.to(device)
+    for engine_name, result in cross_check(args.files, args.engines, args.size).items():
+        print(f"{engine_name}: load {result['load_time']:.2f}s, transcribe {result['transcribe_time']:.2f}s")
+        for file, text, match in zip(args.files, result['transcripts'], result['matches_reference']):
+            print(f"  [{'=' if match else '!'}] {file}: {text}")